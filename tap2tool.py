@@ -1,22 +1,36 @@
+import asyncio
 import binascii
+import contextlib
 import errno
 import functools
+import gzip
 import hashlib
+import importlib.util
 import io
-import signal
+import logging
 import sys
 import os
+import tempfile
+import threading
 import time
+import zlib
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 
 import chardet
+import httpx
 import json
 import numpy
+import orjson
 import pyvo
+import requests
 from pyvo import registry as pyvo_registry
 from pyvo import DALQueryError
 
 import urllib
 from urllib import request, parse
+from xml.sax.saxutils import escape, quoteattr
+
+from lxml import etree
 
 from astropy.io import fits
 
@@ -26,18 +40,26 @@ from astropy.coordinates import SkyCoord
 
 def timeout(seconds=10, error_message=os.strerror(errno.ETIME)):
     def decorator(func):
-        def _handle_timeout(signum, frame):
-            raise TimeoutError(error_message)
-
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            signal.signal(signal.SIGALRM, _handle_timeout)
-            signal.alarm(seconds)
+            # A worker thread is used instead of SIGALRM, which is unavailable
+            # on Windows and outside of the main thread. The call itself cannot
+            # be interrupted, once the timeout is reached it is abandoned on a
+            # daemon thread so it does not keep the interpreter from exiting
+            future = Future()
+
+            def run():
+                try:
+                    future.set_result(func(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+
+            threading.Thread(target=run, daemon=True).start()
+
             try:
-                result = func(*args, **kwargs)
-            finally:
-                signal.alarm(0)
-            return result
+                return future.result(timeout=seconds)
+            except FutureTimeoutError:
+                raise TimeoutError(error_message)
 
         return wrapper
 
@@ -59,6 +81,83 @@ def timeit(method):
     return timed
 
 
+logger = logging.getLogger(__name__)
+
+ARCHIVE_INIT_TIMEOUT = 5
+
+REGISTRY_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "tap2tool")
+REGISTRY_CACHE_FILE = os.path.join(REGISTRY_CACHE_DIR, "registry.json.gz")
+IVOA_ARCHIVES_CACHE_FILE = os.path.join(REGISTRY_CACHE_DIR, "ivoa_archives.json.gz")
+REGISTRY_CACHE_TTL = 24 * 60 * 60
+
+IVOA_ARCHIVES_QUERY = """
+    SELECT DISTINCT access_url
+    FROM rr.res_table
+    NATURAL JOIN rr.capability
+    NATURAL JOIN rr.interface
+    WHERE 1=ivo_nocasematch(table_name, 'ivoa.obscore')
+    AND standard_id LIKE 'ivo://ivoa.net/std/tap%'
+    AND intf_role = 'std'
+"""
+
+REGISTRY_QUERY_TIMEOUT = 60
+
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=32)
+HTTP_TIMEOUT = httpx.Timeout(ARCHIVE_INIT_TIMEOUT)
+
+# httpx only speaks HTTP/2 with the optional h2 package (httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def create_http_client():
+    # One pooled client per event loop, archives hosted on the same server
+    # share their keep-alive connections instead of opening one each
+    return httpx.AsyncClient(limits=HTTP_LIMITS,
+                             timeout=HTTP_TIMEOUT,
+                             http2=HTTP2_AVAILABLE,
+                             follow_redirects=True)
+
+
+def _intern_string(value):
+    # sys.intern only accepts exact str, None and str subclasses are kept as is
+    if type(value) is str:
+        return sys.intern(value)
+
+    return value
+
+
+class TimeoutSession(requests.Session):
+
+    def __init__(self, request_timeout=None):
+        super().__init__()
+        self.request_timeout = request_timeout
+
+    def request(self, *args, **kwargs):
+        # pyvo issues its requests without a timeout, a stalled service would
+        # otherwise block the calling thread forever
+        kwargs.setdefault("timeout", self.request_timeout)
+
+        return super().request(*args, **kwargs)
+
+    @contextlib.contextmanager
+    def bounded(self, request_timeout):
+        # Short timeout for metadata reads only, queries keep the session's own
+        previous_request_timeout = self.request_timeout
+        self.request_timeout = request_timeout
+
+        try:
+            yield self
+        finally:
+            self.request_timeout = previous_request_timeout
+
+
+def create_tap_service(access_url, request_timeout=None, session=None):
+    if session is None:
+        session = TimeoutSession(request_timeout)
+
+    return pyvo.dal.TAPService(access_url, session=session)
+
+
 class NonIVOATapArchiveWrapper:
 
     def __init__(self, access_url, res_title="", short_name=""):
@@ -71,36 +170,86 @@ class TapArchive:
 
     OBSCORE_TABLE = "ivoa.obscore"
 
-    def __init__(self, archive_object):
+    def __init__(self, archive_object, initialize=True):
         self.archive_object = archive_object
         self.initialized = False
         self.service = None
+        self.session = None
         self.tables = None
+        self.name = None
+        self.hash = None
+        self._table_names_lower = frozenset()
 
-        self.initialized = self._initialize()
+        if initialize:
+            self.initialized = self._initialize()
 
-        if self.initialized:
-            self._set_name()
-            self._set_hash()
+            if self.initialized:
+                self._set_name()
+                self._set_hash()
+
+    @classmethod
+    async def from_record(cls, archive_object, client, ivoa_access_urls=frozenset()):
+        archive = cls(archive_object, initialize=False)
+
+        if not archive._set_access_url():
+            return None
+
+        # Archives the registry already lists with an obscore table are
+        # discarded before any of their tables is fetched
+        if _normalize_access_url(archive.access_url) in ivoa_access_urls:
+            return None
+
+        archive.initialized = await archive.ainitialize(client)
+
+        if not archive.initialized:
+            return None
+
+        archive._set_name()
+        archive._set_hash()
+
+        return archive
 
     def _initialize(self):
+        if not self._set_access_url():
+            return False
+
+        self._set_service()
+
         try:
-            self.access_url = self.archive_object.access_url
+            self._set_tables()
         except Exception as e:
             return False
 
-        if self.access_url == "" or self.access_url is None:
-            return False
+        return True
+
+    async def ainitialize(self, client):
+        # Expects access_url to be set, see from_record
 
+        # The service is kept for the queries, the VOSI tables are fetched
+        # through the shared client rather than the service's own session
         self._set_service()
 
         try:
-            self._set_tables()
+            await asyncio.wait_for(self._aset_tables(client), ARCHIVE_INIT_TIMEOUT)
+        except Exception as e:
+            return False
+
+        return True
+
+    def _set_access_url(self):
+        try:
+            self.access_url = self.archive_object.access_url
         except Exception as e:
             return False
 
+        if self.access_url == "" or self.access_url is None:
+            return False
+
         return True
 
+    def _get_tables_url(self):
+        return self.access_url.rstrip("/") + "/tables"
+
     def _set_name(self):
 
         self.name = ''
@@ -116,16 +265,38 @@ class TapArchive:
         if not self.name:
             self._set_name()
 
-        self.hash = hashlib.md5(self.name.encode("utf-8")).hexdigest()
+        self.hash = hashlib.blake2b(self.name.encode("utf-8"), digest_size=16, usedforsecurity=False).hexdigest()
 
     def _set_service(self):
-        self.service = pyvo.dal.TAPService(self.access_url)
+        # The service is kept for searches, which are not bounded by the
+        # initialization timeout
+        self.session = TimeoutSession()
+        self.service = create_tap_service(self.access_url, session=self.session)
 
-    @timeout(5)
-    def _set_tables(self):
+    def _set_tables(self, archive_tables=None):
         tables = []
+        table_names_lower = set()
 
         try:
+            if archive_tables is None:
+                archive_tables = self._read_service_tables()
+
+            for archive_table in archive_tables:
+                tables.append(archive_table)
+
+                if archive_table.name:
+                    table_names_lower.add(archive_table.name.lower())
+        except Exception as e:
+            print(e)
+
+        self.tables = tables
+        self._table_names_lower = frozenset(table_names_lower)
+
+    @timeout(ARCHIVE_INIT_TIMEOUT)
+    def _read_service_tables(self):
+        archive_tables = []
+
+        with self.session.bounded(ARCHIVE_INIT_TIMEOUT):
             for table in self.service.tables:
                 fields = []
 
@@ -137,38 +308,104 @@ class TapArchive:
 
                     fields.append(field)
 
-                archive_table = TapArchive.Table(table.name, table.type, fields)
+                archive_tables.append(TapArchive.Table(table.name, table.type, fields))
 
-                tables.append(archive_table)
+        return archive_tables
+
+    async def _aset_tables(self, client):
+        archive_tables = []
+
+        parser = etree.XMLPullParser(events=("end",), tag="{*}table")
+
+        async with client.stream("GET", self._get_tables_url(), params={"detail": "max"}) as response:
+            response.raise_for_status()
+
+            async for chunk in response.aiter_bytes():
+                parser.feed(chunk)
+                archive_tables.extend(TapArchive._read_vosi_tables(parser))
+
+        # Raises on a truncated document
+        parser.close()
+
+        # VOSI 1.1 services may still answer with a detail=min tableset, the
+        # columns of those tables are read from /tables/<name> like pyvo does
+        archive_tables = await asyncio.gather(*[self._acomplete_table(client, archive_table)
+                                                for archive_table in archive_tables])
+
+        self._set_tables(archive_tables)
+
+    async def _acomplete_table(self, client, archive_table):
+        if archive_table.fields or not archive_table.name:
+            return archive_table
+
+        try:
+            response = await client.get(f"{self._get_tables_url()}/{archive_table.name}")
+            response.raise_for_status()
+
+            root = etree.fromstring(response.content)
         except Exception as e:
-            print(e)
+            return archive_table
 
-        self.tables = tables
+        if etree.QName(root).localname == "table":
+            table = root
+        else:
+            table = root.find(".//{*}table")
+
+        if table is None:
+            return archive_table
+
+        detailed_table = TapArchive._read_vosi_table(table)
+        detailed_table.type = detailed_table.type or archive_table.type
+
+        return detailed_table
+
+    @staticmethod
+    def _read_vosi_tables(parser):
+        for event, table in parser.read_events():
+            yield TapArchive._read_vosi_table(table)
+
+            # Tables already read are dropped, the whole document is never kept in memory
+            table.clear()
+            while table.getprevious() is not None:
+                del table.getparent()[0]
+
+    @staticmethod
+    def _read_vosi_table(table):
+        fields = []
+
+        for table_field in table.iterfind("{*}column"):
+            field = TapArchive.Field(TapArchive._get_element_text(table_field, "name"),
+                                     TapArchive._get_element_text(table_field, "dataType"),
+                                     TapArchive._get_element_text(table_field, "unit"),
+                                     TapArchive._get_element_text(table_field, "description"))
+
+            fields.append(field)
+
+        return TapArchive.Table(TapArchive._get_element_text(table, "name"), table.get("type"), fields)
+
+    @staticmethod
+    def _get_element_text(element, tag):
+        text = element.findtext("{*}" + tag)
+
+        if text is None:
+            return None
+
+        return text.strip()
 
     def get_name(self):
-        if not self.name:
+        if self.name is None:
             self._set_name()
 
         return self.name
 
     def get_hash(self):
-        if not self.hash:
+        if self.hash is None:
             self._set_hash()
 
         return self.hash
 
     def _is_ivoa_compliant(self):
-        is_compliant = False
-
-        try:
-            for table in self.service.tables:
-                if str(table.name).lower() == TapArchive.OBSCORE_TABLE:
-                    is_compliant = True
-                    return is_compliant
-        except Exception as e:
-            print(e)
-
-        return is_compliant
+        return TapArchive.OBSCORE_TABLE in self._table_names_lower
 
     def is_ivoa(self):
         return self._is_ivoa_compliant()
@@ -176,19 +413,62 @@ class TapArchive:
     class Table:
 
         def __init__(self, name, type, fields):
-            self.name = name
-            self.type = type
+            self.name = _intern_string(name)
+            self.type = _intern_string(type)
             self.fields = fields
 
     class Field:
 
         def __init__(self, name, type, unit, description):
-            self.name = name
-            self.type = type
-            self.unit = unit
+            # Column names, types and units repeat across tables and archives
+            self.name = _intern_string(name)
+            self.type = _intern_string(type)
+            self.unit = _intern_string(unit)
             self.description = description
 
 
+def _quote_attribute(value):
+    # Names read from the services can be missing, they are written as text
+    return quoteattr(str(value))
+
+
+def _escape_text(value):
+    return escape(str(value))
+
+
+def _emit_select(buffer, name, label, options):
+    _emit_select_open(buffer, name, label)
+    _emit_options(buffer, options)
+    _emit_select_close(buffer)
+
+
+def _emit_select_open(buffer, name, label):
+    buffer.write(f'<param name={_quote_attribute(name)} type="select" label={_quote_attribute(label)}>\n')
+
+
+def _emit_select_close(buffer):
+    buffer.write('</param>\n')
+
+
+def _emit_options(buffer, options):
+    for value, text in options:
+        buffer.write(f'\t<option value={_quote_attribute(value)}>{_escape_text(text)}</option>\n')
+
+
+def _render_options(options):
+    buffer = io.StringIO()
+    _emit_options(buffer, options)
+
+    return buffer.getvalue()
+
+
+def _format_param(name, label, data_type, help):
+    # data_type is one of ToolParam.allowed_type_list and needs no quoting
+    help_attribute = f' help={_quote_attribute(help)}' if help else ''
+
+    return f'<param name={_quote_attribute(name)} type="{data_type}" label={_quote_attribute(label)}{help_attribute} />'
+
+
 class QueryBuildersBlock:
 
     BLOCK_NAME = "query_type"
@@ -210,6 +490,13 @@ class QueryBuildersBlock:
     ACCESS_URL_INPUT_LABEL = "Url download field"
     ACCESS_URL_INPUT_HELP = "Field containing the download url of the file"
 
+    # Options offered for every archive list, rendered once
+    _STATIC_OPTIONS_XML = _render_options([
+        (GENERIC_QUERY_NAME, GENERIC_QUERY_LABEL),
+        (IVOA_BUILDER_NAME, IVOA_BUILDER_LABEL),
+        (RAW_QUERY_NAME, RAW_QUERY_LABEL)
+    ])
+
     def __init__(self, archive_list):
         self.archive_list = archive_list
         self.builder_selection_block = ""
@@ -220,99 +507,70 @@ class QueryBuildersBlock:
         self.builders_block = self.generate_builders_block()
 
     def generate_builder_selection_block(self):
-        builder_selection_block = ""
-        options = []
-
-        option = ToolOption(QueryBuildersBlock.GENERIC_QUERY_NAME, QueryBuildersBlock.GENERIC_QUERY_LABEL)
-        options.append(option)
+        buffer = io.StringIO()
 
-        option = ToolOption(QueryBuildersBlock.IVOA_BUILDER_NAME, QueryBuildersBlock.IVOA_BUILDER_LABEL)
-        options.append(option)
-
-        option = ToolOption(QueryBuildersBlock.RAW_QUERY_NAME, QueryBuildersBlock.RAW_QUERY_LABEL)
-        options.append(option)
-
-        for archive in self.archive_list:
-            option = ToolOption(archive.get_hash(), archive.get_name())
-            options.append(option)
+        _emit_select_open(buffer, QueryBuildersBlock.BLOCK_NAME, QueryBuildersBlock.BLOCK_LABEL)
+        buffer.write(QueryBuildersBlock._STATIC_OPTIONS_XML)
+        _emit_options(buffer, [(archive.get_hash(), archive.get_name()) for archive in self.archive_list])
+        _emit_select_close(buffer)
 
-        builder_selection_block = ToolSelect(QueryBuildersBlock.BLOCK_NAME, QueryBuildersBlock.BLOCK_LABEL, options)
-
-        return builder_selection_block
+        return buffer.getvalue()
 
     def generate_builders_block(self):
-        builders_block = ""
+        buffer = io.StringIO()
 
         for archive in self.archive_list:
+            buffer.write(f'<when value={_quote_attribute(archive.get_hash())}>\n')
+            buffer.write(ToolConditional.CONDITIONAL_TAG_OPEN)
 
-            xml_params = ""
-
-            query_builder_table_selection_block = self.generate_builder_table_selection_block(archive.tables)
-            query_builder_params = self.generate_builder_params_block(archive.tables)
-
-            xml_params = query_builder_table_selection_block.get_xml()
-
-            for qbp in query_builder_params:
-                xml_params += qbp.get_xml()
-
-            query_builder_block = ToolWhenNested(archive.get_hash(), xml_params)
-
-            builders_block += query_builder_block.get_xml()
-
-        return builders_block
+            self.write_builder_table_selection_block(buffer, archive.tables)
+            self.write_builder_params_block(buffer, archive.tables)
 
-    def generate_builder_params_block(self, archive_tables):
-        query_builders_params = []
+            buffer.write('\n')
+            buffer.write(ToolConditional.CONDITIONAL_TAG_CLOSE)
+            buffer.write('</when>\n')
 
-        for table in archive_tables:
-            fields_params = []
-
-            download_url_param_options = []
+        return buffer.getvalue()
 
-            download_url_param = ToolParam(QueryBuildersBlock.ACCESS_URL_INPUT_NAME,
+    def write_builder_params_block(self, buffer, archive_tables):
+        # Same for every table, its xml is rendered once
+        download_url_param = _format_param(QueryBuildersBlock.ACCESS_URL_INPUT_NAME,
                                            QueryBuildersBlock.ACCESS_URL_INPUT_LABEL,
                                            "text",
                                            QueryBuildersBlock.ACCESS_URL_INPUT_HELP)
 
-            fields_params.append(download_url_param)
+        for table in archive_tables:
+            download_url_param_options = []
+            field_params = []
 
             for field in table.fields:
-                download_url_param_option = ToolOption(field.name, field.name)
-                download_url_param_options.append(download_url_param_option)
-
-                field_param = ToolParam(field.name, field.name, data_type=field.type, help=field.description)
-                fields_params.append(field_param)
-
-            tool_select_name = "download_url"
-            download_url_select = ToolSelect(tool_select_name,
-                                             "Download field",
-                                             download_url_param_options)
+                download_url_param_options.append((field.name, field.name))
+                field_params.append(_format_param(field.name,
+                                                  field.name,
+                                                  ToolParam.get_valid_type(field.type),
+                                                  field.description))
 
-            fields_params.insert(0, download_url_select)
+            buffer.write(f'<when value={_quote_attribute(table.name)}>\n')
 
-            table_params = ToolWhen(table.name, fields_params)
+            buffer.write('\t')
+            _emit_select(buffer, "download_url", "Download field", download_url_param_options)
+            buffer.write('\n')
 
-            query_builders_params.append(table_params)
+            buffer.write(f'\t{download_url_param}\n')
 
-        return query_builders_params
+            for field_param in field_params:
+                buffer.write(f'\t{field_param}\n')
 
-    def generate_builder_table_selection_block(self, archive_tables):
-        builder_table_selection_block = ""
-        options = []
+            buffer.write('</when>\n')
 
-        for table in archive_tables:
-            option = ToolOption(table.name, table.name)
-            options.append(option)
-
-        builder_table_selection_block = ToolSelect(
-            QueryBuildersBlock.TABLE_SELECTION_BLOCK_NAME,
-            QueryBuildersBlock.TABLE_SELECTION_BLOCK_LABEL,
-            options)
-
-        return builder_table_selection_block
+    def write_builder_table_selection_block(self, buffer, archive_tables):
+        _emit_select(buffer,
+                     QueryBuildersBlock.TABLE_SELECTION_BLOCK_NAME,
+                     QueryBuildersBlock.TABLE_SELECTION_BLOCK_LABEL,
+                     [(table.name, table.name) for table in archive_tables])
 
     def get_xml(self):
-        return self.builder_selection_block.get_xml() + self.builders_block
+        return "".join([self.builder_selection_block, self.builders_block])
 
 
 class ToolParam:
@@ -326,19 +584,6 @@ class ToolParam:
         "select"
     ]
 
-    def __init__(self, name, label, data_type=None, help=None):
-        self.name = name
-        self.label = label
-
-        if data_type:
-            self.data_type = data_type
-            if not ToolParam._is_type_valid(data_type):
-                self.data_type = ToolParam.DEFAULT_TYPE
-        else:
-            self.data_type = ToolParam.DEFAULT_TYPE
-
-        self.help = help
-
     @staticmethod
     def _is_type_valid(data_type):
         if data_type in ToolParam.allowed_type_list:
@@ -346,90 +591,12 @@ class ToolParam:
         else:
             return False
 
-    def get_xml(self):
-        if self.data_type and self.help:
-            return f'<param name="{self.name}" type="{self.data_type}" label="{self.label}" help="{self.help}" />'
-        elif self.data_type:
-            return f'<param name="{self.name}" type="{self.data_type}" label="{self.label}" />'
-        elif self.help:
-            return f'<param name="{self.name}" type="{ToolParam.DEFAULT_TYPE}" label="{self.label}" help="{self.help}" />'
+    @staticmethod
+    def get_valid_type(data_type):
+        if data_type and ToolParam._is_type_valid(data_type):
+            return data_type
         else:
-            return f'<param name="{self.name}" type="{ToolParam.DEFAULT_TYPE}" label="{self.label}" />'
-
-
-class ToolOption:
-
-    def __init__(self, value, name):
-        self.value = value
-        self.name = name
-
-    def get_xml(self):
-        return f'<option value="{self.value}">{self.name}</option>'
-
-
-class ToolSelect:
-
-    def __init__(self, name, label, options):
-        self.name = name
-        self.label = label
-        self.options = options
-
-    def get_xml(self):
-        select = ""
-
-        select_top = f'<param name="{self.name}" type="select" label="{self.label}">'
-        select_bot = '</param>'
-
-        select += select_top + '\n'
-
-        for option in self.options:
-            select += '\t' + option.get_xml() + '\n'
-
-        select += select_bot + '\n'
-
-        return select
-
-
-class ToolWhen:
-
-    def __init__(self, value, params):
-        self.value = value
-        self.params = params
-
-    def get_xml(self):
-        when_statement = ""
-
-        when_top = f'<when value="{self.value}">' + '\n'
-        when_bot = '</when>'
-
-        for param in self.params:
-            when_top += '\t' + param.get_xml() + '\n'
-
-        when_statement = when_top + when_bot + '\n'
-
-        return when_statement
-
-
-class ToolWhenNested:
-
-    def __init__(self, value, xml_params):
-        self.value = value
-        self.xml_params = xml_params
-
-    def get_xml(self):
-        when_statement = ""
-
-        when_top = f'<when value="{self.value}">' + '\n'
-        when_top += ToolConditional.CONDITIONAL_TAG_OPEN
-
-        when_bot = ToolConditional.CONDITIONAL_TAG_CLOSE
-        when_bot += '</when>'
-
-        when_top += self.xml_params + '\n'
-
-        when_statement = when_top + when_bot + '\n'
-
-        return when_statement
+            return ToolParam.DEFAULT_TYPE
 
 
 class ToolConditional:
@@ -498,30 +665,29 @@ def _set_archive_tables(archive_service):
 
         tables.append(archive_table)
 
-        print(tables)
+    logger.debug("archive has %d tables", len(tables))
+
+    return tables
 
 
 @timeout(50)
 def _set_archive_tables_summary(archive_service):
 
-    tables = []
-
-    print(archive_service.tables)
+    # Reading the tables fetches the whole VOSI document, only done when logged
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
 
     try:
-        for table in archive_service.tables:
-            print(table.name)
+        tables = list(archive_service.tables)
+        fields_count = sum(len(table.columns) for table in tables)
 
-            for field in table.columns:
-                print(field.name)
+        logger.debug("archive %s has %d tables and %d fields", archive_service.baseurl, len(tables), fields_count)
     except Exception as e:
         print(e)
 
-    #print(tables)
-
 
 def _create_xml_conditional_archive(archive_name, archive_hash):
-    option = f'<option value="{archive_hash}">{archive_name} query builder</option>'
+    option = f'<option value={_quote_attribute(archive_hash)}>{_escape_text(archive_name)} query builder</option>'
     print(option)
     return option
 
@@ -571,31 +737,134 @@ def _get_archive_name(archive_detail):
     else:
         name = archive_detail.access_url
 
+    encoded_name = name.encode("utf-8")
+    name_hash = hashlib.blake2b(encoded_name, digest_size=16, usedforsecurity=False).hexdigest()
+
     print(name)
-    print(hashlib.md5(name.encode("utf-8")).hexdigest())
+    print(name_hash)
+
+    return name_hash, name
+
+
+async def _initialize_archives(archive_records, ivoa_access_urls=frozenset()):
+    async with create_http_client() as client:
+        archives = await asyncio.gather(*[TapArchive.from_record(archive_record, client, ivoa_access_urls)
+                                          for archive_record in archive_records],
+                                        return_exceptions=True)
 
-    return hashlib.md5(name.encode("utf-8")).hexdigest(), name
+    # from_record returns None for skipped archives, gather an exception for failed ones
+    return [archive for archive in archives if isinstance(archive, TapArchive)]
 
 
 def get_non_ivoa_archives(archive_list):
 
     non_ivoa_archives = []
 
-    #for i in range(archive_list.__len__()):
-    for i in range(10):
-        archive_record = archive_list.getrecord(i)
-        archive = TapArchive(archive_record)
-        if archive.initialized:
-            if not archive.is_ivoa():
-                non_ivoa_archives.append(archive)
+    #archive_count = archive_list.__len__()
+    archive_count = 10
+    archive_records = archive_list[:archive_count]
+
+    for archive in asyncio.run(_initialize_archives(archive_records, get_ivoa_access_urls())):
+        if not archive.is_ivoa():
+            non_ivoa_archives.append(archive)
 
     return non_ivoa_archives
 
 
+def _normalize_access_url(access_url):
+    if not access_url:
+        return access_url
+
+    return access_url.rstrip("/")
+
+
+def _get_record_attribute(record, attribute):
+    try:
+        value = getattr(record, attribute)
+    except Exception as e:
+        return None
+
+    if value is None:
+        return None
+
+    return str(value)
+
+
+def _read_registry_cache(cache_file, ttl=REGISTRY_CACHE_TTL):
+    try:
+        if time.time() - os.path.getmtime(cache_file) > ttl:
+            return None
+
+        with open(cache_file, "rb") as cache:
+            return orjson.loads(gzip.decompress(cache.read()))
+    except (OSError, EOFError, ValueError, zlib.error) as e:
+        return None
+
+
+def _write_registry_cache(cache_file, payload):
+    tmp_cache_file = None
+
+    try:
+        cache_dir = os.path.dirname(cache_file)
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Written to a file unique to this run then moved in place, so a
+        # concurrent run never reads or replaces a partial file
+        tmp_cache_fd, tmp_cache_file = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(tmp_cache_fd, "wb") as tmp_cache:
+            with gzip.GzipFile(fileobj=tmp_cache, mode="wb", compresslevel=1) as cache:
+                cache.write(orjson.dumps(payload))
+
+        os.replace(tmp_cache_file, cache_file)
+    except OSError as e:
+        print(e)
+
+        if tmp_cache_file is not None:
+            try:
+                os.remove(tmp_cache_file)
+            except OSError:
+                pass
+
+
+@functools.lru_cache(maxsize=None)
 def get_tap_archives():
-    archive_list = pyvo.registry.search(servicetype="tap")
+    archive_records = _read_registry_cache(REGISTRY_CACHE_FILE)
+
+    if archive_records is None:
+        archive_list = pyvo.registry.search(servicetype="tap")
+
+        archive_records = []
+
+        for archive_record in archive_list:
+            archive_records.append({
+                'access_url': _get_record_attribute(archive_record, 'access_url'),
+                'res_title': _get_record_attribute(archive_record, 'res_title'),
+                'short_name': _get_record_attribute(archive_record, 'short_name')
+            })
+
+        _write_registry_cache(REGISTRY_CACHE_FILE, archive_records)
+
+    return [NonIVOATapArchiveWrapper(**archive_record) for archive_record in archive_records]
+
+
+@functools.lru_cache(maxsize=None)
+def get_ivoa_access_urls():
+    ivoa_access_urls = _read_registry_cache(IVOA_ARCHIVES_CACHE_FILE)
+
+    if ivoa_access_urls is None:
+        try:
+            # Same registry as pyvo.registry.search, IVOA_REGISTRY may override it
+            registry_service = create_tap_service(pyvo_registry.regtap.REGISTRY_BASEURL, REGISTRY_QUERY_TIMEOUT)
+            result = registry_service.search(IVOA_ARCHIVES_QUERY)
+        except Exception as e:
+            print(e)
+            return frozenset()
+
+        ivoa_access_urls = [_normalize_access_url(str(access_url)) for access_url in result['access_url']]
+
+        _write_registry_cache(IVOA_ARCHIVES_CACHE_FILE, ivoa_access_urls)
 
-    return archive_list
+    return frozenset(ivoa_access_urls)
 
 
 def create_query_builders_xml_block():
@@ -627,7 +896,7 @@ def test_custom():
 
     conditional_archive_list = []
 
-    service = pyvo.dal.TAPService("https://datalab.noirlab.edu/tap")
+    service = create_tap_service("https://datalab.noirlab.edu/tap")
 
     print(service)
 
@@ -641,11 +910,11 @@ def test_custom():
     for i in range(10):
 
         try:
-            print(archive_list.getrecord(i).access_url)
-            service = pyvo.dal.TAPService(archive_list.getrecord(i).access_url)
+            archive_record = archive_list.getrecord(i)
+            print(archive_record.access_url)
+            service = create_tap_service(archive_record.access_url)
             _set_archive_tables_summary(service)
-            archive_hash, archive_name = _get_archive_name(archive_list.getrecord(i))
-            _create_xml_conditional_archive(archive_name, archive_hash)
+            archive_hash, archive_name = _get_archive_name(archive_record)
             conditional_archive_list.append(_create_xml_conditional_archive(archive_name, archive_hash))
         except Exception as e:
             print(e)